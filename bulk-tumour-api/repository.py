@@ -1,11 +1,150 @@
+import io
 import os
-import requests
-import pandas as pd
-from typing import Union
-from tqdm.auto import tqdm
-from bs4 import BeautifulSoup
-from .utils import delimiter_type, record_date
-from dataclasses import dataclass, field
+import glob
+import shutil
+import asyncio
+import concurrent.futures
+from pathlib import Path
+from typing import Union, TYPE_CHECKING
+from functools import lru_cache
+from urllib.parse import urljoin
+from .utils import delimiter_type, record_date, cached_get, cached_frame, get_session, get_async_session
+
+# pandas, lxml, httpx and tqdm are slow to import so they are only loaded by the
+# functions that use them
+if TYPE_CHECKING:
+    import httpx
+    import pandas as pd
+
+# Maximum number of sample files fetched from Zenodo at the same time
+_MAX_CONCURRENT_DOWNLOADS = 16
+
+# Number of bytes read from the response before each write to disk (1 MiB)
+_CHUNK_SIZE = 1 << 20
+
+# Selects the <a> tags that store file information on a Zenodo record page
+_FILENAME_XPATH = '//a[contains(@class, "filename")]'
+
+@lru_cache(maxsize=None)
+def _filename_selector():
+    """
+    Returns the file link XPath compiled once per process.
+    """
+    from lxml import etree
+    return etree.XPath(_FILENAME_XPATH)
+
+def load_sample(path: str) -> 'pd.DataFrame':
+    """
+    Loads a downloaded sample file into a data frame.
+    
+    Args:
+        path (str): the path to a sample file saved by .download_synthetic_dataset() (may be gzipped)
+    
+    Example:
+        >>> sample = load_sample('/home/user/data/timing_2022-06-21/sample.tsv')
+    
+    """
+    import pandas as pd
+    return pd.read_csv(path, delimiter=delimiter_type(path), compression='infer', engine='pyarrow', dtype_backend='pyarrow')
+
+def _etag_path(path: Path) -> Path:
+    return path.with_name(path.name + '.etag')
+
+async def _download_one(session: 'httpx.AsyncClient', url: str, out_path: Path, previous: Union[Path, None]) -> None:
+    """
+    Streams a single sample file to the output path without parsing it. The ETag of the
+    file is saved alongside it so unchanged files are not downloaded again.
+    
+    Args:
+        session (httpx.AsyncClient): the client used for the request
+        url (str): the download link for the sample file
+        out_path (Path): the path where the sample file will be saved
+        previous (Path, None): a previously saved copy of the file with an ETag, if any
+    
+    """
+    etag_path = _etag_path(out_path)
+    part_path = out_path.with_name(out_path.name + '.part')
+    
+    # Ask the server to skip the body if the previously saved file is unchanged
+    headers = {}
+    if previous is not None:
+        headers['If-None-Match'] = _etag_path(previous).read_text().strip()
+    
+    async with session.stream('GET', url, headers=headers) as response:
+        if response.status_code == 304:
+            # Reuse a copy saved by an earlier download on another day
+            if previous != out_path:
+                try:
+                    os.link(previous, part_path)
+                except OSError:
+                    shutil.copyfile(previous, part_path)
+                os.replace(part_path, out_path)
+                shutil.copyfile(_etag_path(previous), etag_path)
+            return
+        
+        response.raise_for_status()
+        etag = response.headers.get('ETag')
+        
+        # aiter_bytes undoes any Content-Encoding so the file is written as served
+        try:
+            with open(part_path, 'wb') as f:
+                async for chunk in response.aiter_bytes(_CHUNK_SIZE):
+                    f.write(chunk)
+        except BaseException:
+            # Includes cancellation so a failed or aborted download leaves no partial file
+            part_path.unlink(missing_ok=True)
+            raise
+    
+    # Only replace the saved file and its ETag once the download has completed
+    os.replace(part_path, out_path)
+    if etag:
+        etag_path.write_text(etag)
+    elif etag_path.exists():
+        etag_path.unlink()
+
+async def _download_all(files: list) -> None:
+    """
+    Concurrently downloads a list of sample files.
+    
+    Args:
+        files (list): a list of (url, out_path, previous) tuples as taken by _download_one
+    
+    """
+    from tqdm.auto import tqdm
+    
+    semaphore = asyncio.Semaphore(_MAX_CONCURRENT_DOWNLOADS)
+    async with get_async_session() as session:
+        async def bounded(url, out_path, previous):
+            async with semaphore:
+                await _download_one(session, url, out_path, previous)
+        
+        # Stop the remaining downloads before the client is closed if any of them fails
+        tasks = [asyncio.ensure_future(bounded(*f)) for f in files]
+        try:
+            for task in tqdm.as_completed(tasks, total=len(tasks)):
+                await task
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+def _run_downloads(files: list) -> None:
+    """
+    Runs _download_all to completion. When called from a running event loop (e.g. a
+    Jupyter notebook) the downloads run on a worker thread with its own event loop.
+    
+    Args:
+        files (list): a list of (url, out_path, previous) tuples as taken by _download_one
+    
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(_download_all(files))
+        return
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        executor.submit(lambda: asyncio.run(_download_all(files))).result()
 
 class ZenodoRepository:
     """
@@ -41,27 +180,78 @@ class ZenodoRepository:
             >>> repo.get_contents()
                 
         """
-        # Send a GET request
-        response = requests.get(self.path)
-        
-        # Check if the response was successful
-        if response.ok:
-            text = response.text
-        else:
-            response.raise_for_status()
+        # Send a GET request (or reuse the cached repository listing)
+        text = cached_get(self.path)
         
         # Convert text to parsable HTML
-        soup = BeautifulSoup(text, 'html.parser')
+        from lxml import html
+        tree = html.fromstring(text)
         
         # Subset only <a> tags that store file information
-        tags = soup.find_all("a", {"class": "filename"})
+        tags = _filename_selector()(tree)
+        
+        # Create a list of tuples containing the file name and download link (hrefs
+        # are relative to the Zenodo host, e.g. /record/<id>/files/<name>)
+        base = self.path
+        contents = [(i.text_content().strip(), urljoin(base, i.get('href'))) for i in tags]
         
-        # Create a list of tuples containing the file name and download link
-        self.contents = [(i.contents[0], self.path + i['href']) for i in tags]
+        # Prefer gzipped copies of files when both versions are in the repository
+        names = {name for name, _ in contents}
+        self.contents = [(name, link) for name, link in contents if name + '.gz' not in names]
         
         return self.contents
     
-    def get_database(self, database_name='database.tsv') -> pd.DataFrame:
+    def _read_table(self, url: str, filename: str) -> 'pd.DataFrame':
+        """
+        Loads a delimited text file from a URL, reusing a cached copy when unchanged. The
+        parsed table is also stored as parquet so later loads skip parsing entirely.
+        
+        Args:
+            url (str): the download link for the file
+            filename (str): the name of the file used to infer the delimiter
+        
+        """
+        import pandas as pd
+        
+        # Parse with the multithreaded pyarrow reader into arrow-backed columns
+        def parse(compression):
+            return lambda path: pd.read_csv(
+                path,
+                delimiter=delimiter_type(filename),
+                compression=compression,
+                engine='pyarrow',
+                dtype_backend='pyarrow'
+            )
+        
+        # Prefer a gzipped copy of the file if one is available
+        if not url.endswith('.gz'):
+            df = cached_frame(url + '.gz', parse('gzip'), missing_ok=True)
+            if df is not None:
+                return df
+        
+        return cached_frame(url, parse('gzip' if url.endswith('.gz') else None))
+    
+    def _read_sample(self, filename: str) -> 'pd.DataFrame':
+        """
+        Loads a sample file from the repository without storing it in the on-disk cache.
+        
+        Args:
+            filename (str): the name of the sample file in target zenodo repository
+        
+        """
+        import pandas as pd
+        
+        response = get_session().get(self.path + '/files/' + filename)
+        response.raise_for_status()
+        return pd.read_csv(
+            io.BytesIO(response.content),
+            delimiter=delimiter_type(filename),
+            compression='gzip' if filename.endswith('.gz') else None,
+            engine='pyarrow',
+            dtype_backend='pyarrow'
+        )
+    
+    def get_database(self, database_name='database.tsv') -> 'pd.DataFrame':
         """
         Loads the database file from the target Zenodo repository if present.
         The database file provides information on the structure of the repository
@@ -75,10 +265,10 @@ class ZenodoRepository:
             >>> repo.get_database()
                 
         """        
-        self.database = pd.read_csv(self.path + database_name, delimiter=delimiter_type(database_name))
+        self.database = self._read_table(self.path + database_name, database_name)
         return self.database
     
-    def list_synthetic_datasets(self) -> pd.DataFrame:
+    def list_synthetic_datasets(self) -> 'pd.DataFrame':
         """
         Lists all available synthetic datasets with references and descriptions.
         
@@ -89,10 +279,13 @@ class ZenodoRepository:
             >>> datasets = repo.get_synthetic_datasets()
         
         """
-        self.synthetic_datasets = pd.read_csv(self.path + '/files/' + self.synthetic_datasets_name, delimiter=delimiter_type(self.synthetic_datasets_name))
+        self.synthetic_datasets = self._read_table(self.path + '/files/' + self.synthetic_datasets_name, self.synthetic_datasets_name)
+        
+        # Cache dataset names for constant time lookups of valid datasets
+        self._dataset_names = frozenset(self.synthetic_datasets['dataset'].astype(str).unique())
         return self.synthetic_datasets
     
-    def list_synthetic_samples(self) -> pd.DataFrame:
+    def list_synthetic_samples(self) -> 'pd.DataFrame':
         """
         Lists all the synthetic samples with corresponding summary statistics and metadata
         
@@ -103,12 +296,19 @@ class ZenodoRepository:
             >>> samples = repo.get_synthetic_samples()
         
         """
-        self.synthetic_samples = pd.read_csv(self.path + '/files/' + self.synthetic_samples_name, delimiter=delimiter_type(self.synthetic_samples_name))
+        self.synthetic_samples = self._read_table(self.path + '/files/' + self.synthetic_samples_name, self.synthetic_samples_name)
+        
+        # Index sample files by dataset so downloads do not rescan the table
+        self._samples_by_dataset = {k: v.tolist() for k, v in self.synthetic_samples.groupby('dataset')['file']}
         return self.synthetic_samples
     
     def download_synthetic_dataset(self, dataset_name: str, save_path: str) -> None:
         """
-        Download all samples in one of the available synthetic datasets
+        Download all samples in one of the available synthetic datasets. Files are saved
+        byte-for-byte as served by Zenodo (gzipped when available) and are never parsed,
+        so use load_sample() to read a downloaded sample into a data frame. Samples saved
+        by earlier downloads into the same save_path (including on other days) are only
+        downloaded again if they changed on Zenodo.
         
         Args:
             dataset_name (str): the name of the synthetic dataset listed in .list_synthetic_datasets()
@@ -120,35 +320,49 @@ class ZenodoRepository:
             >>> repo.download_synthetic_dataset(dataset_name='timing', save_path='/home/user/data/')
         
         """
-        # Format save_path string
-        save_path = save_path if save_path[-1] != '/' else save_path[:-1]
-        
         # Load synthetic dataset metadata if not "cached"
-        if not hasattr(self, 'synthetic_datasets'):
-            self.synthetic_datasets = pd.read_csv(self.path + '/files/' + self.synthetic_datasets_name, delimiter=delimiter_type(self.synthetic_datasets_name))            
+        if not hasattr(self, '_dataset_names'):
+            self.list_synthetic_datasets()
         
         # Check if dataset name is valid and download all the data if true
-        if dataset_name in list(self.synthetic['dataset']):
-            # Load samples data frame
-            samples = pd.read_csv(self.path + '/files/' +  self.synthetic_samples_name, delimiter=delimiter_type(self.synthetic_samples_name))
-            
-            # Filter samples by dataset name
-            samples = samples.loc[samples['dataset'] == dataset_name, :]
+        if dataset_name in self._dataset_names:
+            # Load samples data frame if not "cached" and get the samples in the dataset
+            if not hasattr(self, '_samples_by_dataset'):
+                self.list_synthetic_samples()
+            samples = self._samples_by_dataset.get(dataset_name, [])
             
             # Download all the samples
-            print("\033[1mbulk-tumour-api\033[0m\n" + f"Downloading synthetic dataset: {dataset_name}\nNumber of files: {len(samples['file'])}")
-            for sample in tqdm(samples['file']):
-                timestamp = record_date()
-                
-                # Check if data path already exists
-                if not os.path.exists(save_path + '/' + dataset_name + '_' + timestamp):
-                    os.makedirs(save_path + '/' + dataset_name + '_' + timestamp)
+            print("\033[1mbulk-tumour-api\033[0m\n" + f"Downloading synthetic dataset: {dataset_name}\nNumber of files: {len(samples)}")
+            
+            # Every sample in the dataset is saved to the same directory
+            timestamp = record_date()
+            out_dir = Path(save_path) / f"{dataset_name}_{timestamp}"
+            out_dir.mkdir(parents=True, exist_ok=True)
+            
+            # Download gzipped copies of samples when available and keep them compressed on disk
+            contents = self.contents if hasattr(self, 'contents') else self.get_contents()
+            gzipped = {name for name, _ in contents if name.endswith('.gz')}
+            
+            # Earlier downloads of the same dataset, most recent first, are revalidated with their ETags
+            previous_dirs = sorted(
+                (d for d in out_dir.parent.glob(glob.escape(dataset_name) + '_????-??-??') if d != out_dir and d.is_dir()),
+                reverse=True
+            )
+            
+            base_url = self.path + '/files/'
+            files = []
+            for sample in samples:
+                if sample + '.gz' in gzipped:
+                    sample = sample + '.gz'
                 
-                # Load and save sample data
-                pd.read_csv(self.path + '/files/' +  sample, delimiter=delimiter_type(sample)).to_csv(
-                    save_path + '/' + dataset_name + '_' + timestamp + '/' + sample,
-                    index = False
+                previous = next(
+                    (p for p in (d / sample for d in [out_dir, *previous_dirs]) if p.exists() and _etag_path(p).exists()),
+                    None
                 )
+                files.append((base_url + sample, out_dir / sample, previous))
+            
+            # Save sample data concurrently (use load_sample to parse a saved file)
+            _run_downloads(files)
             
         else:
             raise ValueError(
@@ -156,28 +370,40 @@ class ZenodoRepository:
                 Please call .get_synthetic_datasets() to see the available synthetic datasets.'
             )
         
-    def get_synthetic_sample(self, sample: str) -> dict:
+    def get_synthetic_sample(self, sample: Union[str, list]) -> dict:
+        """
+        Loads one or more synthetic samples along with every file that shares their identifier
+        
+        Args:
+            sample (str, list): a sample file name or list of sample file names listed in .list_synthetic_samples()
+        
+        Example:
+            >>> data = repo.get_synthetic_sample('sample.tsv')
+        
+        """
         # Load synthetic dataset metadata if not "cached"
         if not hasattr(self, 'synthetic_samples'):
-            self.synthetic_samples = pd.read_csv(self.path + '/files/' + self.synthetic_samples_name, delimiter=delimiter_type(self.synthetic_samples_name))
+            self.list_synthetic_samples()
         
-        # Extract length of 1 list
-        if (type(samples) == list) & (len(samples) == 1):
-            samples = samples[0]
+        samples = [sample] if isinstance(sample, str) else list(sample)
         
-        # Single sample loading
-        if (type(samples) == str):
-            # Filter sample
-            sample = self.synthetic_samples.loc[self.synthetic_samples['file'] == samples, :]
-            
-            # Grabs all files associated with sample (if has_meta = True <=> same identifier)
-            all_files = self.synthetic_samples.loc[self.synthetic_samples['identifier'] == list(sample['identifier'])[0], :]
-            
-            # Loadall sample data into a list
-            all_files = {
-                f: pd.read_csv(self.path + '/files/' +  f, delimiter=delimiter_type(f))
-                for f in all_files['file']
-            }
-            
-            return all_files
+        # Filter samples
+        synthetic_samples = self.synthetic_samples
+        selected = synthetic_samples.loc[synthetic_samples['file'].isin(samples), :]
+        
+        missing = set(samples) - set(selected['file'])
+        if missing:
+            raise ValueError(
+                f'The samples {sorted(missing)} do not exist in the synthetic sample list. \
+                Please call .list_synthetic_samples() to see the available synthetic samples.'
+            )
+        
+        # Grabs all files associated with samples (if has_meta = True <=> same identifier)
+        all_files = synthetic_samples.loc[synthetic_samples['identifier'].isin(selected['identifier']), 'file']
+        
+        # Load all sample data into a dictionary
+        return {
+            f: self._read_sample(f)
+            for f in all_files
+        }
                 
\ No newline at end of file
@@ -1,22 +1,232 @@
+import os
+import re
+import json
+import time
+import hashlib
 from datetime import datetime
+from typing import Union, Callable, TYPE_CHECKING
+
+# httpx and pandas are only imported once they are needed
+if TYPE_CHECKING:
+    import httpx
+    import pandas as pd
+
+# Connection settings shared by the synchronous and asynchronous clients. Requests are
+# multiplexed over a few HTTP/2 connections to Zenodo instead of one connection per file
+_MAX_CONNECTIONS = 4
+_HEADERS = {'Accept-Encoding': 'gzip, deflate'}
+# Per request timeout in seconds. Waiting for a free connection is not limited since
+# queued downloads may wait on other files streaming over the same connections
+_TIMEOUT = 30
+
+# A single client shared by every request to Zenodo so that the underlying
+# TLS connections are pooled and kept alive between files
+_SESSION = None
+
+def get_session() -> 'httpx.Client':
+    """
+    Returns the HTTP client shared by all requests made to a Zenodo repository.
+    """
+    global _SESSION
+    if _SESSION is None:
+        import httpx
+        _SESSION = httpx.Client(
+            transport=httpx.HTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_connections=_MAX_CONNECTIONS, max_keepalive_connections=_MAX_CONNECTIONS),
+                retries=3
+            ),
+            headers=_HEADERS,
+            timeout=httpx.Timeout(_TIMEOUT, pool=None),
+            follow_redirects=True
+        )
+    return _SESSION
+
+def get_async_session() -> 'httpx.AsyncClient':
+    """
+    Returns a new asynchronous HTTP client configured like the shared client. It must be
+    created and closed within the event loop that uses it.
+    """
+    import httpx
+    return httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            limits=httpx.Limits(max_connections=_MAX_CONNECTIONS, max_keepalive_connections=_MAX_CONNECTIONS),
+            retries=3
+        ),
+        headers=_HEADERS,
+        timeout=httpx.Timeout(_TIMEOUT, pool=None),
+        follow_redirects=True
+    )
+
+# Responses from Zenodo are stored here and reused across runs
+_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'bulk-tumour-api')
+
+# Number of seconds a cached response is used before it is revalidated with the server
+_CACHE_EXPIRE_AFTER = 86400
+
+def cache_dir() -> str:
+    """
+    Returns the directory where responses from Zenodo are cached.
+    """
+    return _CACHE_DIR
+
+def _write_cache_meta(meta_path: str, meta: dict) -> None:
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(meta_path + '.tmp', meta_path)
+
+def _validator(meta: dict, body_path: str) -> str:
+    # Identifies a version of a cached body, falling back to its write time without validators
+    return meta.get('etag') or meta.get('last_modified') or str(os.path.getmtime(body_path))
+
+def cached_path(url: str, missing_ok: bool = False) -> Union[tuple, None]:
+    """
+    Makes a GET request and returns the path to the cached body along with a string that
+    identifies its version (the ETag when available). Cached responses younger than a day
+    are returned without contacting the server, older ones are revalidated using their
+    ETag or Last-Modified headers.
+    
+    Args:
+        url (str): the URL to request
+        missing_ok (bool): if True, return None (and remember it) when the server responds with 404
+    """
+    body_path = os.path.join(_CACHE_DIR, hashlib.sha256(url.encode()).hexdigest())
+    meta_path = body_path + '.json'
+    
+    # Load validators of a previously cached response
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        
+        fresh = time.time() - os.path.getmtime(meta_path) < _CACHE_EXPIRE_AFTER
+        if meta.get('missing'):
+            if fresh and missing_ok:
+                return None
+            meta = None
+        elif not os.path.exists(body_path):
+            meta = None
+        elif fresh:
+            return body_path, _validator(meta, body_path)
+    
+    headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    
+    response = get_session().get(url, headers=headers)
+    
+    # Remote file is unchanged so refresh the cache timestamp and reuse the body
+    if response.status_code == 304 and meta is not None:
+        os.utime(meta_path)
+        return body_path, _validator(meta, body_path)
+    
+    os.makedirs(_CACHE_DIR, exist_ok=True)
+    
+    # Remember that the file does not exist so the lookup is not repeated every run
+    if response.status_code == 404 and missing_ok:
+        _write_cache_meta(meta_path, {'url': url, 'missing': True})
+        return None
+    
+    response.raise_for_status()
+    
+    # Write to temporary files first so an interrupted run never leaves a partial entry
+    with open(body_path + '.tmp', 'wb') as f:
+        f.write(response.content)
+    os.replace(body_path + '.tmp', body_path)
+    
+    meta = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified')
+    }
+    _write_cache_meta(meta_path, meta)
+    
+    return body_path, _validator(meta, body_path)
+
+def cached_get(url: str, missing_ok: bool = False) -> Union[bytes, None]:
+    """
+    Returns the body of a GET request, reusing a copy cached on disk if available.
+    See cached_path() for how cached responses are revalidated.
+    
+    Args:
+        url (str): the URL to request
+        missing_ok (bool): if True, return None (and remember it) when the server responds with 404
+    """
+    cached = cached_path(url, missing_ok=missing_ok)
+    if cached is None:
+        return None
+    
+    with open(cached[0], 'rb') as f:
+        return f.read()
+
+def cached_frame(url: str, parse: Callable[[str], 'pd.DataFrame'], missing_ok: bool = False) -> Union['pd.DataFrame', None]:
+    """
+    Returns the data frame parsed from the body of a GET request. The parsed table is stored
+    as parquet next to the cached body, and its validator is recorded in the cache metadata
+    so each version of a file is only parsed once and older versions are overwritten.
+    
+    Args:
+        url (str): the URL to request
+        parse (Callable): a function that parses the path of the cached body into a data frame
+        missing_ok (bool): if True, return None (and remember it) when the server responds with 404
+    """
+    import pandas as pd
+    
+    cached = cached_path(url, missing_ok=missing_ok)
+    if cached is None:
+        return None
+    
+    body_path, validator = cached
+    parquet_path = body_path + '.parquet'
+    meta_path = body_path + '.json'
+    with open(meta_path) as f:
+        meta = json.load(f)
+    
+    # Reuse the parsed table if this version of the file has been loaded before
+    if meta.get('parquet') == validator and os.path.exists(parquet_path):
+        return pd.read_parquet(parquet_path, engine='pyarrow', memory_map=True, dtype_backend='pyarrow')
+    
+    df = parse(body_path)
+    df.to_parquet(parquet_path + '.tmp', engine='pyarrow')
+    os.replace(parquet_path + '.tmp', parquet_path)
+    
+    # Record the parsed version without extending how long the cached response is fresh
+    mtime = os.path.getmtime(meta_path)
+    meta['parquet'] = validator
+    _write_cache_meta(meta_path, meta)
+    os.utime(meta_path, (mtime, mtime))
+    
+    return df
+
+# Delimiter used by each supported text file extension
+_DELIM_BY_EXT = {'csv': ',', 'tsv': '\t', 'txt': '\t'}
+
+# Matches a supported extension, optionally followed by .gz, at the end of a filename
+_EXT_RE = re.compile(r'\.(csv|tsv|txt)(?:\.gz)?$', re.I)
 
 def delimiter_type(filename: str) -> str:
     """
-    Returns the delimiter type when loading a formatted text file.
+    Returns the delimiter type when loading a formatted text file. Gzipped files
+    (e.g. .tsv.gz) use the delimiter of the underlying extension.
     
     Args:
         filename (str): a string that includes the filename at end of string 
     """
-    try:
-        if filename[-4:] == ".csv":
-            return ","
-        if filename[-4:] in [".tsv", ".txt"]:
-            return "\t"
-    except:
-        raise SyntaxError("The database file must be in .csv, .tsv, or .txt format.")
+    m = _EXT_RE.search(filename)
+    if m is None:
+        raise ValueError(f"The file must be in .csv, .tsv, or .txt format, got '{os.path.splitext(filename)[1]}'.")
+    return _DELIM_BY_EXT[m.group(1).lower()]
     
 def record_date(tosec=False):
-  if tosec == True:
-    return 'h'.join(str(datetime.now()).split(' '))
-  else:
-    return ''.join(str(datetime.now()).split(' ')[0])
\ No newline at end of file
+    """
+    Returns the current date (e.g. 2022-06-21), or the date and time to the second
+    (e.g. 2022-06-21h14-05-33) if tosec is True.
+    
+    Args:
+        tosec (bool): if True, include the time to the second
+    """
+    return datetime.now().strftime('%Y-%m-%dh%H-%M-%S' if tosec else '%Y-%m-%d')
\ No newline at end of file
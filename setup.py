@@ -7,12 +7,19 @@ version = '0.1'
 
 setup(name='bulk-tumour-api',
       version=version,
-      python_requires='>3.6',
+      python_requires='>=3.8',
       description='A python API for accessing and downloading bulk tumour sequencing data stored in a Zenodo repository',
       author='Tom W. Ouellette',
       author_email='t.ouellette@mail.utoronto.ca',
       license='MIT',
       packages=find_packages(),
       #install_requires=requirements,
+      install_requires=[
+          'httpx[http2]',
+          'lxml',
+          'pandas>=2.0',
+          'pyarrow',
+          'tqdm>=4.61.2',
+      ],
       include_package_data=True,
 )	
\ No newline at end of file